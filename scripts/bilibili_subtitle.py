@@ -1,11 +1,103 @@
 import json
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj):
+    """紧凑格式序列化为 str，保留非 ASCII 字符"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+# 从视频链接中提取 BV 号和分P参数
+_BV_RE = re.compile(r'BV[a-zA-Z0-9]+')
+_P_RE = re.compile(r'[?&]p=(\d+)')
+
+# 请求超时（连接, 读取），单位秒
+REQUEST_TIMEOUT = (3.05, 10)
+
+# api.bilibili.com 按状态码重试的次数及退避参数，由 _api_get 负责
+API_RETRY_STATUSES = (412, 429, 500, 502, 503, 504)
+API_MAX_RETRIES = 3
+API_BACKOFF_FACTOR = 0.3
+API_BACKOFF_MAX = 10
+
+def _create_session():
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # API 请求只在连接层重试，状态码重试放到 _api_get 中，确保每次重试都经过限流
+    api_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3, respect_retry_after_header=False))
+    session.mount('https://api.bilibili.com', api_adapter)
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://www.bilibili.com'
+    })
+    return session
+
+# 模块级会话，复用连接池避免每次请求重新建立 TCP/TLS 连接
+_SESSION = _create_session()
+
+class _RateLimiter:
+    """令牌桶限流器，线程安全"""
+
+    def __init__(self, max_rate, time_period=1.0):
+        self.capacity = max_rate
+        self.rate = max_rate / time_period
+        self._tokens = float(max_rate)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+# 限制对 api.bilibili.com 的请求频率，避免高并发时触发 412/429 风控。
+# 限流器按进程生效，使用多个 gunicorn worker 时总速率为 5 × worker 数
+_API_LIMITER = _RateLimiter(max_rate=5, time_period=1)
+
+def _retry_delay(response, attempt):
+    """优先使用 Retry-After，否则按指数退避"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), API_BACKOFF_MAX)
+    return min(API_BACKOFF_FACTOR * (2 ** attempt), API_BACKOFF_MAX)
+
+def _api_get(url, headers):
+    for attempt in range(API_MAX_RETRIES + 1):
+        _API_LIMITER.acquire()
+        response = _SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code not in API_RETRY_STATUSES or attempt == API_MAX_RETRIES:
+            return response
+        time.sleep(_retry_delay(response, attempt))
 
 def load_cookie_from_file(cookie_file):
     try:
@@ -15,71 +107,132 @@ def load_cookie_from_file(cookie_file):
         print(f"读取cookie文件失败: {e}")
         return None
 
-def get_subtitle(bvid, cookie, p=1):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://www.bilibili.com',
-        'Cookie': cookie
-    }
-
+def _fetch_subtitle_body(url, headers):
+    """获取字幕文件并返回其 body 列表，失败时返回 None"""
     try:
-        # 获取视频信息
-        video_info_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(video_info_url, headers=headers)
-        video_info = response.json()
-        
-        if video_info['code'] != 0:
-            return {'success': False, 'message': video_info['message']}
+        response = _SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        content = _json_loads(response.content)
+        if not isinstance(content, dict):
+            return None
+        return content.get('body')
+    except (requests.RequestException, ValueError):
+        return None
 
-        title = video_info['data']['title']
-        aid = video_info['data']['aid']
-        
-        # 获取分P信息
-        pages = video_info['data']['pages']
-        if p > len(pages):
-            return {'success': False, 'message': f'分P号超出范围，最大分P号为 {len(pages)}'}
-            
-        # 获取指定分P的cid
-        cid = pages[p-1]['cid']  # 注意：p从1开始，数组从0开始
-        part_title = pages[p-1]['part']  # 获取分P标题
-        
-        print(f"标题: {title} - {part_title} (P{p})")
+class _TTLCache:
+    """带过期时间的 LRU 缓存，线程安全"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+# 字幕缓存时间（秒），同一 cid 的字幕内容基本不会变化
+SUBTITLE_CACHE_TTL = 3600
+
+# 按 (bvid, p) 缓存字幕结果；公开字幕与 cookie 无关，因此不参与缓存键
+_SUBTITLE_CACHE = _TTLCache(maxsize=2048, ttl=SUBTITLE_CACHE_TTL)
 
-        # 获取字幕列表
-        subtitle_url = f'https://api.bilibili.com/x/player/wbi/v2?aid={aid}&cid={cid}'
-        response = requests.get(subtitle_url, headers=headers)
-        subtitle_info = response.json()
+def fetch_subtitle(bvid, cookie, p=1):
+    """获取视频标题和字幕 body，结果会被缓存"""
+    cache_key = (bvid, p)
+    result = _SUBTITLE_CACHE.get(cache_key)
+    if result is not None:
+        return result
 
-        if subtitle_info['code'] != 0:
-            return {'success': False, 'message': '获取字幕列表失败'}
+    headers = {'Cookie': cookie or ''}
 
-        subtitles = subtitle_info['data']['subtitle'].get('subtitles', [])
+    # 获取视频信息
+    video_info_url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
+    response = _api_get(video_info_url, headers)
+    video_info = _json_loads(response.content)
+    
+    if video_info['code'] != 0:
+        return {'success': False, 'message': video_info['message']}
+
+    title = video_info['data']['title']
+    aid = video_info['data']['aid']
+    
+    # 获取分P信息
+    pages = video_info['data']['pages']
+    if p > len(pages):
+        return {'success': False, 'message': f'分P号超出范围，最大分P号为 {len(pages)}'}
         
-        # 获取字幕内容
-        if subtitles:
-            subtitle = next((s for s in subtitles if 'zh' in s['lan']), subtitles[0])
-            subtitle_url = subtitle["subtitle_url"]
-            if subtitle_url.startswith('//'):
-                subtitle_url = 'https:' + subtitle_url
-            
-            response = requests.get(subtitle_url, headers=headers)
-            if response.status_code == 200:
-                subtitle_content = response.json()
-                if subtitle_content.get('body'):
-                    for line in subtitle_content['body']:
-                        print(f"字幕:{json.dumps(line, ensure_ascii=False)}")
-                    return
+    # 获取指定分P的cid
+    cid = pages[p-1]['cid']  # 注意：p从1开始，数组从0开始
+    part_title = pages[p-1]['part']  # 获取分P标题
+
+    # 获取字幕列表
+    subtitle_url = f'https://api.bilibili.com/x/player/wbi/v2?aid={aid}&cid={cid}'
+    response = _api_get(subtitle_url, headers)
+    subtitle_info = _json_loads(response.content)
+
+    if subtitle_info['code'] != 0:
+        return {'success': False, 'message': '获取字幕列表失败'}
+
+    subtitles = subtitle_info['data']['subtitle'].get('subtitles', [])
+    
+    # 获取字幕内容，人工字幕优先
+    body = None
+    if subtitles:
+        subtitle = next((s for s in subtitles if 'zh' in s['lan']), subtitles[0])
+        subtitle_url = subtitle["subtitle_url"]
+        if subtitle_url.startswith('//'):
+            subtitle_url = 'https:' + subtitle_url
         
-        # 如果没有人工字幕，尝试获取AI字幕
+        body = _fetch_subtitle_body(subtitle_url, headers)
+    
+    # 如果没有人工字幕，尝试获取AI字幕
+    if not body:
         ai_subtitle_url = f'https://aisubtitle.hdslb.com/bfs/ai_subtitle/prod/{aid}{cid}.json'
-        response = requests.get(ai_subtitle_url, headers=headers)
-        
-        if response.status_code == 200:
-            ai_subtitle_content = response.json()
-            if ai_subtitle_content.get('body'):
-                for line in ai_subtitle_content['body']:
-                    print(f"字幕:{json.dumps(line, ensure_ascii=False)}")
-                return
+        body = _fetch_subtitle_body(ai_subtitle_url, headers)
+
+    result = {
+        'success': True,
+        'title': title,
+        'part': part_title,
+        'p': p,
+        'body': body or []
+    }
+    # 没有字幕时不缓存，AI字幕可能稍后才生成
+    if body:
+        _SUBTITLE_CACHE.set(cache_key, result)
+    return result
+
+def get_subtitle(bvid, cookie, p=1):
+    try:
+        result = fetch_subtitle(bvid, cookie, p)
+        if not result['success']:
+            return result
+
+        print(f"标题: {result['title']} - {result['part']} (P{p})")
+
+        if result['body']:
+            # 拼接后一次性写出，避免逐行 print 的开销
+            sys.stdout.write(''.join(f"字幕:{_json_dumps(line)}\n" for line in result['body']))
+            sys.stdout.flush()
+            return
 
         print("字幕:[]")  # 如果没有找到任何字幕，返回空数组
         
@@ -87,8 +240,20 @@ def get_subtitle(bvid, cookie, p=1):
         print(f"错误:{str(e)}", file=sys.stderr)
         sys.exit(1)
 
-def run_server():
+class ORJSONProvider(DefaultJSONProvider):
+    """使用 orjson 的 Flask JSON provider"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def create_app():
     app = Flask(__name__)
+    app.debug = False
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
     # 修改 CORS 配置
     CORS(app, resources={
         r"/*": {
@@ -137,10 +302,10 @@ def run_server():
             
             # 从URL中提取p参数
             if 'bilibili.com' in bvid:
-                p_match = re.search(r'[?&]p=(\d+)', bvid)
+                p_match = _P_RE.search(bvid)
                 if p_match:
                     p = int(p_match.group(1))
-                bvid_match = re.search(r'BV[a-zA-Z0-9]+', bvid)
+                bvid_match = _BV_RE.search(bvid)
                 if bvid_match:
                     bvid = bvid_match.group(0)
                 else:
@@ -151,13 +316,24 @@ def run_server():
                     })
 
             print(f"处理字幕请求: BV号={bvid}, P={p}")
-            result = get_subtitle(bvid, cookie, p)
-            
+            result = fetch_subtitle(bvid, cookie, p)
+            if not result['success']:
+                return jsonify({
+                    'success': False,
+                    'message': result['message'],
+                    'data': None
+                })
+
             # 确保响应包含所有必要的字段
             response = jsonify({
                 'success': True,
                 'message': '获取字幕成功',
-                'data': result
+                'data': {
+                    'title': result['title'],
+                    'part': result['part'],
+                    'p': result['p'],
+                    'body': result['body']
+                }
             })
             
             # 添加 CORS 头
@@ -173,12 +349,17 @@ def run_server():
                 'data': None
             })
 
+    return app
+
+def run_server():
+    app = create_app()
     print("启动服务器在 http://127.0.0.1:6789")
-    # 修改服务器配置
+    # 开发服务器仅用于本地调试，生产环境请通过 wsgi.py 使用 gunicorn 启动
+    # 设置 FLASK_DEBUG=1 可开启调试模式
     app.run(
         host='127.0.0.1',
         port=6789,
-        debug=True,
+        debug=os.environ.get('FLASK_DEBUG') == '1',
         threaded=True,
         use_reloader=False  # 禁用重新加载器以避免重复启动
     )
@@ -210,27 +391,18 @@ def main():
     try:
         result = get_subtitle(args.bvid, cookie, args.p)  # 传入分P参数
         
-        # 清理结果中的特殊字符
-        if isinstance(result, dict):
-            if 'title' in result:
-                result['title'] = result['title'].encode('utf-8').decode('utf-8', 'ignore')
-            if 'lines' in result and isinstance(result['lines'], list):
-                for line in result['lines']:
-                    if 'text' in line:
-                        line['text'] = line['text'].encode('utf-8').decode('utf-8', 'ignore')
-        
         if args.output:
             with open(args.output, 'w', encoding='utf-8') as f:
                 json.dump(result, f, ensure_ascii=False, indent=2)
         else:
             # 使用紧凑的JSON格式出，避免额外的空白字符
-            print(json.dumps(result, ensure_ascii=False, separators=(',', ':')))
+            print(_json_dumps(result))
             sys.stdout.flush()
     except Exception as e:
-        print(json.dumps({
+        print(_json_dumps({
             "error": str(e),
             "success": False
-        }, ensure_ascii=False))
+        }))
         sys.stdout.flush()
         sys.exit(1)
 
@@ -0,0 +1,222 @@
+import unittest
+from unittest import mock
+
+import bilibili_subtitle
+from bilibili_subtitle import _RateLimiter, _TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+
+def fake_get(responses):
+    def get(url, **kwargs):
+        for prefix, response in responses.items():
+            if url.startswith(prefix):
+                return response
+        raise AssertionError(f'unexpected url {url}')
+    return get
+
+
+VIEW_URL = 'https://api.bilibili.com/x/web-interface/view'
+PLAYER_URL = 'https://api.bilibili.com/x/player/wbi/v2'
+AI_URL = 'https://aisubtitle.hdslb.com/'
+
+VIEW_RESPONSE = FakeResponse(
+    b'{"code":0,"data":{"title":"t","aid":1,"pages":[{"cid":2,"part":"p1"}]}}'
+)
+NO_SUBTITLES_RESPONSE = FakeResponse(b'{"code":0,"data":{"subtitle":{"subtitles":[]}}}')
+
+
+class TTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(bilibili_subtitle, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_returns_value_until_ttl_expires(self):
+        cache = _TTLCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+
+        self.clock.now = 9
+        self.assertEqual(cache.get('a'), 1)
+
+        self.clock.now = 11
+        self.assertIsNone(cache.get('a'))
+
+    def test_evicts_least_recently_used(self):
+        cache = _TTLCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+
+class FetchSubtitleCacheTest(unittest.TestCase):
+    def setUp(self):
+        for name, value in (
+            ('_SUBTITLE_CACHE', _TTLCache(maxsize=8, ttl=60)),
+            ('_API_LIMITER', _RateLimiter(max_rate=1000)),
+        ):
+            patcher = mock.patch.object(bilibili_subtitle, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_caches_non_empty_body(self):
+        responses = {
+            VIEW_URL: VIEW_RESPONSE,
+            PLAYER_URL: NO_SUBTITLES_RESPONSE,
+            AI_URL: FakeResponse(b'{"body":[{"from":0,"to":1,"content":"x"}]}'),
+        }
+        with mock.patch.object(bilibili_subtitle._SESSION, 'get', side_effect=fake_get(responses)) as get:
+            first = bilibili_subtitle.fetch_subtitle('BV1', '')
+            second = bilibili_subtitle.fetch_subtitle('BV1', '')
+
+        self.assertEqual(first['body'], [{'from': 0, 'to': 1, 'content': 'x'}])
+        self.assertIs(first, second)
+        self.assertEqual(get.call_count, 3)
+
+    def test_does_not_cache_empty_body(self):
+        responses = {
+            VIEW_URL: VIEW_RESPONSE,
+            PLAYER_URL: NO_SUBTITLES_RESPONSE,
+            AI_URL: FakeResponse(b'', status_code=404),
+        }
+        with mock.patch.object(bilibili_subtitle._SESSION, 'get', side_effect=fake_get(responses)) as get:
+            first = bilibili_subtitle.fetch_subtitle('BV1', '')
+            bilibili_subtitle.fetch_subtitle('BV1', '')
+
+        self.assertEqual(first['body'], [])
+        self.assertEqual(get.call_count, 6)
+
+    def test_ignores_non_object_subtitle_json(self):
+        responses = {
+            VIEW_URL: VIEW_RESPONSE,
+            PLAYER_URL: NO_SUBTITLES_RESPONSE,
+            AI_URL: FakeResponse(b'[]'),
+        }
+        with mock.patch.object(bilibili_subtitle._SESSION, 'get', side_effect=fake_get(responses)):
+            result = bilibili_subtitle.fetch_subtitle('BV1', '')
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['body'], [])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(bilibili_subtitle, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_allows_burst_then_throttles(self):
+        limiter = _RateLimiter(max_rate=5, time_period=1)
+
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        limiter.acquire()
+        self.assertAlmostEqual(self.clock.sleeps[-1], 0.2)
+
+    def test_refills_over_time(self):
+        limiter = _RateLimiter(max_rate=5, time_period=1)
+        for _ in range(5):
+            limiter.acquire()
+
+        self.clock.now += 1
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+
+class ApiGetTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.events = []
+        for target, name, value in (
+            (bilibili_subtitle, 'time', self.clock),
+            (bilibili_subtitle._API_LIMITER, 'acquire', lambda: self.events.append('acquire')),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def api_get(self, *responses):
+        responses = list(responses)
+
+        def get(url, **kwargs):
+            self.events.append('get')
+            return responses.pop(0)
+
+        with mock.patch.object(bilibili_subtitle._SESSION, 'get', side_effect=get):
+            return bilibili_subtitle._api_get(VIEW_URL, {})
+
+    def test_retries_throttled_and_server_errors(self):
+        for status in bilibili_subtitle.API_RETRY_STATUSES:
+            with self.subTest(status=status):
+                self.events.clear()
+                response = self.api_get(FakeResponse(b'', status), FakeResponse(b'ok'))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.events.count('get'), 2)
+
+    def test_acquires_before_every_attempt_with_exponential_backoff(self):
+        response = self.api_get(
+            FakeResponse(b'', 412), FakeResponse(b'', 412), FakeResponse(b'', 412), FakeResponse(b'ok')
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.events, ['acquire', 'get'] * 4)
+        self.assertEqual([round(s, 2) for s in self.clock.sleeps], [0.3, 0.6, 1.2])
+
+    def test_honours_and_caps_retry_after(self):
+        short = FakeResponse(b'', 429)
+        short.headers['Retry-After'] = '2'
+        long = FakeResponse(b'', 429)
+        long.headers['Retry-After'] = '60'
+
+        self.api_get(short, long, FakeResponse(b'ok'))
+
+        self.assertEqual(self.clock.sleeps, [2, bilibili_subtitle.API_BACKOFF_MAX])
+
+    def test_returns_last_response_after_max_retries(self):
+        attempts = bilibili_subtitle.API_MAX_RETRIES + 1
+        responses = [FakeResponse(b'', 412) for _ in range(attempts)]
+
+        response = self.api_get(*responses)
+
+        self.assertIs(response, responses[-1])
+        self.assertEqual(self.events.count('get'), attempts)
+        self.assertEqual(len(self.clock.sleeps), bilibili_subtitle.API_MAX_RETRIES)
+
+    def test_does_not_retry_other_statuses(self):
+        response = self.api_get(FakeResponse(b'', 404))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.events, ['acquire', 'get'])
+        self.assertEqual(self.clock.sleeps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,11 @@
+"""gunicorn 入口
+
+依赖（需另行安装）:
+    pip install gunicorn gevent
+
+启动方式:
+    gunicorn -k gevent -w $(nproc) --worker-connections 1000 --keep-alive 5 -b 127.0.0.1:6789 wsgi:app
+"""
+from bilibili_subtitle import create_app
+
+app = create_app()